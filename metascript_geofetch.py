@@ -1,133 +1,340 @@
 import subprocess
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from geofetch import Finder
 import argparse
+import hashlib
 import os
+import re
+import shutil
+import time
+import numpy as np
 import pandas as pd
-from fnmatch import fnmatch
-
-def combine_csvs_by_columns(directory, output_csv=None, pattern="gse*_raw.csv"):
+from fnmatch import translate
+
+# use arrow's multithreaded csv reader and writer when pyarrow is available, else plain pandas
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    READ_CSV_KWARGS = {"engine": "pyarrow", "dtype_backend": "pyarrow"}
+    # null handling of pandas' pyarrow engine, for files read with pyarrow.csv directly
+    ARROW_CONVERT_OPTIONS = pa_csv.ConvertOptions(null_values=pa_csv.ConvertOptions().null_values + ["<NA>", "None"],
+                                                  strings_can_be_null=True)
+except ImportError:
+    pa = None
+    READ_CSV_KWARGS = {"engine": "c"}
+
+# caches live outside the metadata directory, which a --target run renames, so they survive filter iterations
+CACHE_DIR = ".meta_geofetch_cache"
+GEOFETCH_CACHE_MAX_AGE = 7 * 24 * 60 * 60  # seconds after which a cached geofetch call is repeated
+SEARCH_CACHE_MAX_AGE = 24 * 60 * 60  # seconds after which a cached geo search is repeated
+
+def find_files(directory, pattern):
     """
-    Finds all CSV files matching a pattern in a directory and its subdirectories,
-    and concatenates them into one DataFrame based on column names,
-    ordering the columns in a specific way. It also formats the 'sample_contact_name' column.
+    Yields paths of all files matching a glob pattern in a directory and its subdirectories.
 
     Args:
         directory (str): The directory to start the search from.
-        output_csv (str, optional): The name of the output CSV file. If None, returns the DataFrame.
-        pattern (str, optional): The file name pattern to match. Defaults to "*.csv".
+        pattern (str): The file name pattern to match.
     """
+    regex = re.compile(translate(pattern))  # compile the glob once instead of per file
+    stack = [directory]
+    while stack:
+        current = stack.pop()
+        subdirectories = []
+        try:
+            with os.scandir(current) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirectories.append(entry.path)
+                    elif regex.match(entry.name):
+                        yield entry.path
+        except OSError as e:
+            print(f"error scanning {current}: {e}")
+        stack.extend(reversed(subdirectories))  # visit subdirectories in os.walk order, so the row order is unchanged
+
+def deduplicate_columns(columns):
+    """
+    Renames repeated column names to name.1, name.2, ... as pandas' default C engine does,
+    since the pyarrow readers keep repeated CSV headers unchanged.
 
+    Args:
+        columns (list): The column names as read from the file.
 
-    def standartize_parameters(metadata):
-        """
-        Standartizes parameters in the metadata
-        """
-
-        conversion_dict = {
-            "fgo": "FGO",
-            "1cell" : "1C",
-            "2cell" : "2C",
-            "4cell" : "4C",
-            "8cell" : "8C",
-            "1-cell": "1C",
-            "1_cell": "1C",
-            "2-cell": "2C",
-            "2_cell": "2C",
-            "4_cell": "4C",
-            "4-cell": "4C",
-            "8_cell": "8C",
-            "8-cell": "8C",
-            "zygote": "1C",
-            "e11_5": "E11.5",
-            "mesc": "ESC",
-            "mes": "ESC",
-            "esc": "ESC",
-            "tsc": "TSC",
-            "icm": "ICM",
-            "te": "TE",
-            "e5_5": "E5.5",
-            "e14": "E14",
-            "e16_5": "E16.5",
-            "gv": "GV",
-            "mii": "MII",
-            "e6_5epi": "E6.5Epi",
-            "e6_5_epi": "E6.5Epi",
-            "e65epi": "E6.5Epi",
-            "morula": "morula",
-            "blastocyst": "blastocyst",
-            "pn5": "pn5",
-            "pn3": "pn3"
-        }
-        
-        metadata.insert(1, column = "stage_std", value = pd.NA)
-        for index, row in metadata.iterrows():
-            found_match = False
-            cols_to_check = ["developmental_stage", "sample_source_name_ch1", "sample_name"]
-            for col in cols_to_check:
-                if isinstance(row[col], str):
-                    for pattern, value in conversion_dict.items():
-                        if pattern.lower() in row[col].lower():
-                            metadata.loc[index, "stage_std"] = value
-                            found_match = True
-                            break
-                if found_match:
-                    break
-
-
-    all_data = pd.DataFrame()  # initialize an empty dataframe
-    files_found = False #added
+    Returns:
+        list: The column names with every name unique.
+    """
+    header = set(columns)
+    counts = {}
+    unique_columns = []
+    for col in columns:
+        name = col
+        count = counts.get(col, 0)
+        while count > 0:  # skip suffixes that are taken, including by names later in the header
+            counts[col] = count + 1
+            name = f"{col}.{count}"
+            count = count + 1 if name in header else counts.get(name, 0)
+        unique_columns.append(name)
+        counts[name] = count + 1
+    return unique_columns
+
+def write_csv(df, path, header=True):
+    """
+    Writes a DataFrame to a CSV file without the index, using pyarrow's CSV writer when available.
+    Note that pyarrow quotes all strings and writes booleans as true/false, unlike DataFrame.to_csv.
 
-    for root, _, files in os.walk(directory):  # Change to os.walk to recurse subdirectories
-        for file in files:
-            if fnmatch(file, pattern):  # use fnmatch for pattern matching
-                file_path = os.path.join(root, file)
-                try:
-                    df = pd.read_csv(file_path)
-                    # Format 'sample_contact_name' if it exists (case-insensitive check)
-                    for col in df.columns:
-                        if col.lower() == 'sample_contact_name':
-                            print(f"Found column: {col}")
-                            print(f"Data before formatting:\n{df['sample_contact_name'].head()}")
-                            df['sample_contact_name'] = df['sample_contact_name'].apply(format_contact_name)
-                            print(f"Data after formatting:\n{df['sample_contact_name'].head()}")
-                            print(f"Formatted column: {col}")
-                            break
-                    else:
-                        print(f"'sample_contact_name' column not found in {file_path}")
+    Args:
+        df (pd.DataFrame): The DataFrame to write.
+        path (str or file): The path of the output CSV file, or a file opened in binary mode.
+        header (bool, optional): Whether to write the column names. Defaults to True.
+    """
+    if pa is not None:
+        try:
+            table = pa.Table.from_pandas(df, preserve_index=False)
+        except pa.ArrowException:
+            # object columns mixing types (e.g. numbers and text from different files) are written as text,
+            # so the output format only depends on whether pyarrow is installed
+            object_columns = df.columns[df.dtypes == object]
+            table = pa.Table.from_pandas(df.astype({col: "string" for col in object_columns}), preserve_index=False)
+        pa_csv.write_csv(table, path, write_options=pa_csv.WriteOptions(include_header=header))
+        return
+    df.to_csv(path, index=False, header=header)
+
+def cache_path(cache_dir, key, extension):
+    """
+    Returns the path of the cache file for a key, named by the key's sha1 hash.
 
-                    all_data = pd.concat([all_data, df], ignore_index=True, sort=False)  # concatenate dataframes
-                    print(f"appended: {file_path}")
-                    files_found = True #set to true
-                except Exception as e:
-                    print(f"error reading {file_path}: {e}")
+    Args:
+        cache_dir (str): The directory holding the cache files.
+        key (str): The value identifying the cached result.
+        extension (str): The file extension of the cache file.
+    """
+    return os.path.join(cache_dir, f"{hashlib.sha1(key.encode()).hexdigest()}.{extension}")
+
+def is_cache_fresh(path, max_age):
+    """
+    Checks whether a cache file exists and was written less than max_age seconds ago.
+    """
+    try:
+        return time.time() - os.path.getmtime(path) < max_age
+    except OSError:
+        return False
 
+def run_geofetch(command, stderr_path):
+    """
+    Runs a geofetch command, discarding its stdout and streaming its stderr to a file.
+    The file is removed if geofetch succeeds, so only the stderr of failed calls is kept.
+
+    Args:
+        command (list): The geofetch command and its arguments.
+        stderr_path (str): The file that receives the stderr of geofetch.
+
+    Raises:
+        subprocess.CalledProcessError: If geofetch exits with a non-zero status.
+    """
+    with open(stderr_path, 'w') as stderr:
+        subprocess.run(command, check=True, stdout=subprocess.DEVNULL, stderr=stderr)
+    os.remove(stderr_path)
+
+def standartize_parameters(metadata):
+    """
+    Standartizes parameters in the metadata
+    """
+
+    conversion_dict = {
+        "fgo": "FGO",
+        "1cell" : "1C",
+        "2cell" : "2C",
+        "4cell" : "4C",
+        "8cell" : "8C",
+        "1-cell": "1C",
+        "1_cell": "1C",
+        "2-cell": "2C",
+        "2_cell": "2C",
+        "4_cell": "4C",
+        "4-cell": "4C",
+        "8_cell": "8C",
+        "8-cell": "8C",
+        "zygote": "1C",
+        "e11_5": "E11.5",
+        "mesc": "ESC",
+        "mes": "ESC",
+        "esc": "ESC",
+        "tsc": "TSC",
+        "icm": "ICM",
+        "te": "TE",
+        "e5_5": "E5.5",
+        "e14": "E14",
+        "e16_5": "E16.5",
+        "gv": "GV",
+        "mii": "MII",
+        "e6_5epi": "E6.5Epi",
+        "e6_5_epi": "E6.5Epi",
+        "e65epi": "E6.5Epi",
+        "morula": "morula",
+        "blastocyst": "blastocyst",
+        "pn5": "pn5",
+        "pn3": "pn3"
+    }
+    
+    metadata.insert(1, column = "stage_std", value = pd.NA)
+    for index, row in metadata.iterrows():
+        found_match = False
+        cols_to_check = ["developmental_stage", "sample_source_name_ch1", "sample_name"]
+        for col in cols_to_check:
+            if isinstance(row[col], str):
+                for pattern, value in conversion_dict.items():
+                    if pattern.lower() in row[col].lower():
+                        metadata.loc[index, "stage_std"] = value
+                        found_match = True
+                        break
+            if found_match:
+                break
+
+def order_columns(columns):
+    """
+    Orders metadata columns: the main sample columns first, then two empty separator columns,
+    the remaining columns and finally the sample source and organism columns.
+
+    Args:
+        columns (list): The column names present in the data.
+
+    Returns:
+        list: The column names in the desired order, including the separator columns.
+    """
     # define the desired order for the initial columns
     first_columns_set = ['sample_geo_accession', 'development_stage', 'genotype', 'treatment',
                             'sample_library_strategy', 'antibody', 'sample_contact_name',
                             'sample_submission_date', 'sample_name', 'big_key']
 
-    # Get the actual first columns present in the data
-    first_columns = [col for col in first_columns_set if col in all_data.columns]
-
     # Define the columns to appear at the position after the two empty separators
     middle_columns_set = ['sample_source_name_ch1', 'organism']
 
+    # Get the actual first columns present in the data
+    first_columns = [col for col in first_columns_set if col in columns]
+
     # Get the actual middle columns present in the data
-    middle_columns = [col for col in middle_columns_set if col in all_data.columns]
+    middle_columns = [col for col in middle_columns_set if col in columns]
 
     # Get the remaining columns, excluding those in first_columns_set and middle_columns_set
-    remaining_columns = [col for col in all_data.columns if col not in first_columns_set and col not in middle_columns_set]
+    remaining_columns = [col for col in columns if col not in first_columns_set and col not in middle_columns_set]
+
+    return first_columns + ['separator_1', 'separator_2'] + remaining_columns + middle_columns
+
+def unify_column_types(tables):
+    """
+    Casts the columns whose types cannot be merged across tables (e.g. numbers in one file, text in another)
+    to strings, so the tables can be concatenated with pyarrow.
 
-    column_order = first_columns + ['separator_1', 'separator_2'] + remaining_columns + middle_columns
+    Args:
+        tables (list): The pyarrow tables to concatenate.
 
-    # reindex the dataframe with the desired column order
-    all_data = all_data.reindex(columns=column_order)
+    Returns:
+        list: The tables, with conflicting columns cast to strings.
+    """
+    column_types = {}
+    for table in tables:
+        for field in table.schema:
+            column_types.setdefault(field.name, set()).add(field.type)
+
+    conflicting = set()
+    for name, types in column_types.items():
+        if len(types) > 1:
+            try:
+                pa.unify_schemas([pa.schema([pa.field(name, t)]) for t in types], promote_options="permissive")
+            except pa.ArrowException:
+                conflicting.add(name)
+
+    if not conflicting:
+        return tables
+    for i, table in enumerate(tables):
+        for name in conflicting.intersection(table.column_names):
+            index = table.schema.get_field_index(name)
+            table = table.set_column(index, name, table.column(index).cast(pa.string()))
+        tables[i] = table
+    return tables
+
+def combine_csvs_by_columns(directory, output_csv=None, pattern="gse*_raw.csv"):
+    """
+    Finds all CSV files matching a pattern in a directory and its subdirectories,
+    and concatenates them into one DataFrame based on column names,
+    ordering the columns in a specific way. It also formats the 'sample_contact_name' column.
+
+    Args:
+        directory (str): The directory to start the search from.
+        output_csv (str, optional): The name of the output CSV file. If None, returns the DataFrame.
+        pattern (str, optional): The file name pattern to match. Defaults to "*.csv".
+    """
+
+    frames = []  # collect per-file dataframes, concatenated once after the walk
+    tables = []  # per-file arrow tables, used instead of frames when pyarrow is available
+    files_found = False #added
+
+    for file_path in find_files(directory, pattern):
+        try:
+            if pa is not None:
+                table = pa_csv.read_csv(file_path, convert_options=ARROW_CONVERT_OPTIONS)
+                # lowercase names so lookups can be exact, then rename repeats (also ones created by lowercasing)
+                tables.append(table.rename_columns(deduplicate_columns([col.lower() for col in table.column_names])))
+            else:
+                df = pd.read_csv(file_path, **READ_CSV_KWARGS)
+                df.columns = deduplicate_columns(list(df.columns.str.lower()))  # lowercase names so lookups can be exact
+                frames.append(df)
+            print(f"appended: {file_path}")
+            files_found = True #set to true
+        except Exception as e:
+            print(f"error reading {file_path}: {e}")
+
+    # concatenating arrow-backed frames in pandas costs a separate step for every column of every file,
+    # so combine the arrow tables directly and convert the result to pandas once
+    if tables:
+        try:
+            tables = unify_column_types(tables)  # e.g. a column that is numeric in one file and text in another
+            frames = [pa.concat_tables(tables, promote_options="permissive").to_pandas(types_mapper=pd.ArrowDtype)]
+        except pa.ArrowException as e:
+            print(f"could not combine the files with pyarrow, combining them with pandas: {e}")
+            frames = [table.to_pandas(types_mapper=pd.ArrowDtype) for table in tables]
+
+    # Collect the columns of all files in order of first appearance, as concat would, with their dtypes
+    column_dtypes = {}
+    for df in frames:
+        for col, dtype in df.dtypes.items():
+            column_dtypes.setdefault(col, dtype)
+    column_order = order_columns(list(column_dtypes))
+
+    # reindex every frame to the desired column order first, so the single concat joins aligned frames;
+    # columns missing from a file are filled in the dtype they have elsewhere (e.g. arrow dates) instead of float NaN,
+    # and missing boolean columns are filled with object NaN so True/False don't turn into 1.0/0.0
+    for i, df in enumerate(frames):
+        fillers = {}
+        for col, dtype in column_dtypes.items():
+            if col in df.columns:
+                continue
+            if isinstance(dtype, pd.api.extensions.ExtensionDtype):
+                fillers[col] = pd.array([pd.NA] * len(df), dtype=dtype)
+            elif dtype == bool:
+                fillers[col] = np.full(len(df), np.nan, dtype=object)
+        if fillers:
+            df = pd.concat([df, pd.DataFrame(fillers, index=df.index)], axis=1, copy=False)
+        frames[i] = df.reindex(columns=column_order, copy=False)
+
+    if len(frames) == 1:
+        all_data = frames[0]  # a single file is already in its final shape, no concat needed
+    elif frames:
+        all_data = pd.concat(frames, ignore_index=True, sort=False, copy=False)
+    else:
+        all_data = pd.DataFrame(columns=column_order)
+
+    # Format 'sample_contact_name' once on the combined data
+    if 'sample_contact_name' in all_data.columns:
+        all_data['sample_contact_name'] = format_contact_names(all_data['sample_contact_name'])
+    elif files_found:
+        print("'sample_contact_name' column not found in the combined data")
     
     if 'developmental_stage' in all_data.columns:
         standartize_parameters(all_data)
 
     if output_csv:
-        all_data.to_csv(output_csv, index=False)  # save the combined dataframe to a csv file
+        write_csv(all_data, output_csv)  # save the combined dataframe to a csv file
         print(f"finished combining csv files into {output_csv} with specified column order and separator columns.")
         return all_data
     elif files_found: #check if files were found
@@ -135,25 +342,67 @@ def combine_csvs_by_columns(directory, output_csv=None, pattern="gse*_raw.csv"):
     else:
         return None
 
-def format_contact_name(name):
+def stream_csvs_by_columns(directory, output_csv, pattern="gse*_raw.csv"):
     """
-    Formats a contact name string from "First,,Last" to "LastF".
+    Finds all CSV files matching a pattern in a directory and its subdirectories,
+    and appends them one by one to a single CSV file instead of combining them in memory.
+    The column order is taken from the first file, so all files are expected to share its columns;
+    columns that the first file does not have are dropped.
 
     Args:
-        name (str): The contact name string.
+        directory (str): The directory to start the search from.
+        output_csv (str): The name of the output CSV file.
+        pattern (str, optional): The file name pattern to match. Defaults to "gse*_raw.csv".
 
     Returns:
-        str: The formatted contact name, or the original name if formatting fails.
+        int: The number of rows written, or None if no files were found.
     """
-    if not isinstance(name, str) or not name:  # Handle non-string or empty input
-        return name
-    parts = name.split(',,')
-    if len(parts) >= 2:
-        first_name = parts[0].strip()
-        last_name = parts[-1].strip()
-        if first_name and last_name:
-            return f"{last_name}{first_name[0]}"
-    return name  # Return the original name if the format is not as expected
+    column_order = None
+    rows_written = 0
+
+    with open(output_csv, 'wb') as out:
+        for file_path in find_files(directory, pattern):
+            try:
+                df = pd.read_csv(file_path, **READ_CSV_KWARGS)
+            except Exception as e:
+                print(f"error reading {file_path}: {e}")
+                continue
+            df.columns = deduplicate_columns(list(df.columns.str.lower()))  # lowercase names so lookups can be exact
+
+            if column_order is None:
+                column_order = order_columns(list(df.columns))
+            else:
+                dropped_columns = [col for col in df.columns if col not in column_order]
+                if dropped_columns:
+                    print(f"columns not present in the first file are dropped from {file_path}: {dropped_columns}")
+            df = df.reindex(columns=column_order)
+
+            if 'sample_contact_name' in df.columns:
+                df['sample_contact_name'] = format_contact_names(df['sample_contact_name'])
+            if 'developmental_stage' in df.columns:
+                standartize_parameters(df)
+
+            write_csv(df, out, header=out.tell() == 0)  # header only once, from the first file
+            rows_written += len(df)
+            print(f"appended: {file_path}")
+
+    return rows_written if column_order is not None else None
+
+def format_contact_names(names):
+    """
+    Formats contact name strings from "First,,Last" to "LastF".
+
+    Args:
+        names (pd.Series): The contact name strings.
+
+    Returns:
+        pd.Series: The formatted contact names; entries not in the expected format are returned unchanged.
+    """
+    strings = names.astype("string")
+    first_name = strings.str.partition(",,", expand=False).str[0].str.strip()
+    last_name = strings.str.rpartition(",,", expand=False).str[-1].str.strip()
+    valid = (strings.str.contains(",,", regex=False) & (first_name.str.len() > 0) & (last_name.str.len() > 0)).fillna(False)
+    return names.mask(valid, last_name + first_name.str[0])
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="fetch geo metadata, process gses, combine and filter raw csv files.")
@@ -164,6 +413,10 @@ if __name__ == "__main__":
     parser.add_argument("-o", "--output_file", dest="output_list_file", default="metadata/metadata.txt",
                             help="the path to save the list of found gse accessions (default: metadata/metadata.txt)")
     parser.add_argument("--discard_soft", action="store_true", help="discard soft files during geofetch")
+    parser.add_argument("--no_cache", action="store_true",
+                            help="rerun the geo search and geofetch for every gse, including gses whose directories already exist")
+    parser.add_argument("--stream", action="store_true",
+                            help="write the combined csv file by file instead of in memory; for raw csv files sharing the same columns, skips filtering")
     parser.add_argument("--raw_data_dir", dest="raw_data_directory", default=".",
                             help="the directory to search for raw csv files for combining (default: current working directory)")
     parser.add_argument("--combined_output_csv", dest="combined_output_csv", default="combined_raw_data.csv",
@@ -179,6 +432,8 @@ if __name__ == "__main__":
     target_filter = args.target
     output_list_file = args.output_list_file
     discard_soft = args.discard_soft
+    no_cache = args.no_cache
+    stream = args.stream
     raw_data_directory = args.raw_data_directory
     combined_output_csv = args.combined_output_csv
     raw_data_pattern = args.raw_data_pattern
@@ -200,11 +455,35 @@ if __name__ == "__main__":
     else:
         target_filter = target_filter.strip()
 
+    if os.path.dirname(output_list_file):
+        os.makedirs(os.path.dirname(output_list_file), exist_ok=True)
+
+    metadata_dir = "metadata"
+
+    # number of concurrent geofetch calls, checked before any work is done
+    geofetch_jobs = os.environ.get("GEOFETCH_JOBS", "8")
+    try:
+        max_workers = int(geofetch_jobs)
+    except ValueError:
+        max_workers = 0
+    if max_workers < 1:
+        print(f"error: GEOFETCH_JOBS must be a positive integer, got '{geofetch_jobs}'.")
+        exit(1)
+
     # --- python part 1: fetch gses and save to a list file ---
     try:
-        os.makedirs(os.path.dirname(output_list_file), exist_ok=True)
-        gse_obj = Finder(filters=search_string)
-        gse_list = gse_obj.get_gse_all()
+        # results of the same search are reused for a day, so rerunning with other filters skips the ncbi query
+        search_cache = cache_path(os.path.join(CACHE_DIR, "search"), search_string, "txt")
+        if not no_cache and is_cache_fresh(search_cache, SEARCH_CACHE_MAX_AGE):
+            with open(search_cache, 'r') as f:
+                gse_list = f.read().split()
+            print(f"using cached search results from {search_cache}")
+        else:
+            gse_obj = Finder(filters=search_string)
+            gse_list = gse_obj.get_gse_all()
+            os.makedirs(os.path.dirname(search_cache), exist_ok=True)
+            with open(search_cache, 'w') as f:
+                f.write("".join(f"{gse}\n" for gse in gse_list))
         print(f"found the following gses: {gse_list}")
 
         with open(output_list_file, 'w') as f:
@@ -224,30 +503,54 @@ if __name__ == "__main__":
         print(f"error: input file '{output_list_file}' not found.")
         exit(1)
 
-    metadata_dir = "metadata"
     try:
-        with open(output_list_file, 'r') as f:
-            for line in f:
-                gse = line.strip()
-                if gse:
-                    gse_dir = os.path.join(metadata_dir, gse) #create path for each gse
-                    if not os.path.exists(gse_dir): #check if the directory exists
-                        output_filename = f"{metadata_dir}/metadata_{gse}.txt"
-                        os.makedirs(os.path.dirname(output_filename), exist_ok=True)
-                        command = ["geofetch", "--just-metadata", "--discard-soft", "-i", gse, "-u", f"{metadata_dir}/"]
-                        process = subprocess.run(command, check=True, capture_output=True, text=True)
-                        print(f"processed gse: {gse}, metadata saved to {output_filename}")
-                        if process.stderr:
-                            print(f"error output for gse {gse}: {process.stderr}")
-                    else:
-                        print(f"GSE directory {gse_dir} already exists, skipping download") # Added skipping
+        # list the already downloaded gse directories once instead of checking each gse separately
+        existing_gses = set(os.listdir(metadata_dir)) if os.path.isdir(metadata_dir) else set()
+
+        with open(output_list_file, 'rb') as f:
+            listed_gses = [gse.decode() for gse in f.read().split()]  # one read, whitespace split drops empty lines
+
+        pending_gses = []
+        for gse in listed_gses:
+            if gse in existing_gses and not no_cache: #check if the directory exists
+                print(f"GSE directory {os.path.join(metadata_dir, gse)} already exists, skipping download (use --no_cache to refetch)") # Added skipping
+                continue
+            pending_gses.append(gse)
+
+        os.makedirs(metadata_dir, exist_ok=True)  # created once for all geofetch calls
+
+        # successful geofetch calls that download nothing leave a sentinel file keyed by the command, so reruns
+        # can skip them; gses with a directory are skipped by the check above as long as the directory is there
+        cache_dir = os.path.join(CACHE_DIR, "geofetch")
+        os.makedirs(cache_dir, exist_ok=True)
+
+        # geofetch calls are i/o bound, so run them concurrently; a failing gse does not stop the others
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {}
+            for gse in pending_gses:
+                command = ["geofetch", "--just-metadata", "--discard-soft", "-i", gse, "-u", f"{metadata_dir}/"]
+                sentinel = cache_path(cache_dir, " ".join(command), "ok")
+                if not no_cache and is_cache_fresh(sentinel, GEOFETCH_CACHE_MAX_AGE):
+                    print(f"gse {gse} had no data in a previous run, skipping download (use --no_cache to refetch)")
+                    continue
+                stderr_path = f"{metadata_dir}/{gse}.stderr"  # kept and read back only if geofetch fails
+                futures[executor.submit(run_geofetch, command, stderr_path)] = (gse, sentinel, stderr_path)
+
+            for future in as_completed(futures):
+                gse, sentinel, stderr_path = futures[future]
+                output_filename = f"{metadata_dir}/metadata_{gse}.txt"
+                try:
+                    future.result()
+                    if not os.path.isdir(os.path.join(metadata_dir, gse)):
+                        open(sentinel, 'w').close()  # written from the main thread only, so no locking is needed
+                    print(f"processed gse: {gse}, metadata saved to {output_filename}")
+                except subprocess.CalledProcessError as e:
+                    print(f"error executing geofetch for gse {gse}: {e}")
+                    with open(stderr_path, 'r') as f:
+                        print(f"stderr: {f.read()}")
     except FileNotFoundError:
         print(f"error: input file '{output_list_file}' not found.")
         exit(1)
-    except subprocess.CalledProcessError as e:
-        print(f"error executing geofetch for gse {gse}: {e}")
-        print(f"stderr: {e.stderr}")
-        pass
     except Exception as e:
         print(f"an error occurred during metadata fetching: {e}")
         pass
@@ -257,57 +560,78 @@ if __name__ == "__main__":
     # --- python part 2: combine raw csv
     print("\n--- combining raw csv files ---")
     # changed raw_data_directory to metadata
+    if stream:
+        rows_written = stream_csvs_by_columns(metadata_dir, combined_output_csv, pattern=raw_data_pattern)
+        if rows_written is None:
+            print("no data to combine.")
+        else:
+            print(f"streamed {rows_written} rows into {combined_output_csv}, filters are not applied with --stream")
+        exit(0)
+
+    # with a target filter the metadata directory is renamed at the end, so write csv files given by a bare name
+    # into it and let that single rename carry them; csv files given with a directory are moved afterwards
+    write_into_metadata_dir = bool(target_filter) and not os.path.dirname(combined_output_csv)
+    if write_into_metadata_dir:
+        combined_output_csv = os.path.join(metadata_dir, combined_output_csv)
     combined_df = combine_csvs_by_columns(metadata_dir, output_csv=combined_output_csv, pattern=raw_data_pattern)
-    print(combined_df)
+    if combined_df is not None:
+        print(f"combined frame: {combined_df.shape[0]} rows x {combined_df.shape[1]} cols")
     if combined_df is not None and not combined_df.empty:
         print("\n--- applying filters ---")
-        filtered_df = combined_df.copy()  # Create a copy to avoid modifying the original
+        mask = np.ones(len(combined_df), dtype=bool)  # combine all filters and select the rows once
 
-        # Apply filters independently
+        # Apply filters independently; user input is escaped so it matches literally
         if organism_filter:
             print(f"filtering by organism: '{organism_filter}' in 'organism' column (case-insensitive)")
-            filtered_df = filtered_df[filtered_df['organism'].str.contains(organism_filter, na=False, case=False)]
+            mask &= combined_df['organism'].str.contains(re.escape(organism_filter), na=False, case=False).to_numpy(dtype=bool)
 
         if assay_filter:
             print(f"filtering by assay type: '{assay_filter}' in 'sample_library_strategy' column (case-insensitive)")
-            filtered_df = filtered_df[filtered_df['sample_library_strategy'].str.contains(assay_filter, na=False, case=False)]
+            mask &= combined_df['sample_library_strategy'].str.contains(re.escape(assay_filter), na=False, case=False).to_numpy(dtype=bool)
 
         if target_filter:
             print(f"filtering by target: '{target_filter}' in 'sample_name' column (case-insensitive)")
-            filtered_df = filtered_df[filtered_df['sample_name'].str.lower().str.contains(target_filter.lower(), na=False, case=False)]
+            mask &= combined_df['sample_name'].str.contains(re.escape(target_filter), na=False, case=False).to_numpy(dtype=bool)
 
         if search_string.startswith('GSM'):
             print(f"filtering by GSM")
             gsm_list = search_string.split()
-            filtered_df = filtered_df[filtered_df['sample_geo_accession'].isin(gsm_list)]
+            mask &= combined_df['sample_geo_accession'].isin(gsm_list).to_numpy(dtype=bool)
 
+        filtered_df = combined_df.loc[mask]
         output_csv_filtered = combined_output_csv.replace(".csv", "_filtered.csv")
-        filtered_df.to_csv(output_csv_filtered, index=False)
+        write_csv(filtered_df, output_csv_filtered)
         print(f"filtered data saved to {output_csv_filtered}")
 
-        # Rename metadata directory and move filtered CSV
+        # Rename metadata directory, which already holds the combined and filtered CSV
         if target_filter:
             new_metadata_dir = target_filter
             print(f"Target directory: {new_metadata_dir}") #added
             print(f"Metadata directory: {metadata_dir}") #added
-            if os.path.exists(metadata_dir):
+            if os.path.exists(new_metadata_dir) and os.path.samefile(metadata_dir, new_metadata_dir):
+                print(f"directory '{metadata_dir}' is already in place, not renaming")
+            elif os.path.exists(new_metadata_dir):
+                # shutil.move would put metadata_dir inside an existing directory instead of renaming it
+                print(f"error renaming directory: '{new_metadata_dir}' already exists")
+                if write_into_metadata_dir:
+                    print(f"combined and filtered csv files remain in '{metadata_dir}'")
+            else:
                 try:
-                    os.rename(metadata_dir, new_metadata_dir)
-                    print(f"renamed directory '{metadata_dir}' to '{new_metadata_dir}'")
-                    # Move the filtered CSV file
-                    try:
-                        print(f"Moving {output_csv_filtered} to {new_metadata_dir}") #added
-                        print(f"Moving {combined_output_csv} to {new_metadata_dir}") #added
-                        os.rename(output_csv_filtered, os.path.join(new_metadata_dir, output_csv_filtered))
-                        os.rename(combined_output_csv, os.path.join(new_metadata_dir, combined_output_csv)) # Move the combined CSV
-                        print(f"moved {output_csv_filtered} and {combined_output_csv} to {new_metadata_dir}")
-                    except Exception as e:
-                        print(f"error moving filtered and combined csv: {e}")
+                    shutil.move(metadata_dir, new_metadata_dir)  # a plain rename, or copy and delete across filesystems
+                    if write_into_metadata_dir:
+                        print(f"renamed directory '{metadata_dir}' to '{new_metadata_dir}', including {os.path.basename(combined_output_csv)} and {os.path.basename(output_csv_filtered)}")
+                    else:
+                        print(f"renamed directory '{metadata_dir}' to '{new_metadata_dir}'")
+                        try:
+                            for csv_path in (output_csv_filtered, combined_output_csv):
+                                shutil.move(csv_path, os.path.join(new_metadata_dir, os.path.basename(csv_path)))
+                            print(f"moved {output_csv_filtered} and {combined_output_csv} to {new_metadata_dir}")
+                        except Exception as e:
+                            print(f"error moving filtered and combined csv: {e}")
                 except Exception as e:
                     print(f"error renaming directory: {e}")
-                    pass
-            else:
-                print(f"error: directory '{metadata_dir}' not found.")
+                    if write_into_metadata_dir:
+                        print(f"combined and filtered csv files remain in '{metadata_dir}'")
         else:
             print("target filter was empty, will not rename metadata directory")
     else: